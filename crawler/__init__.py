@@ -1,6 +1,7 @@
 from utils import get_logger
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler.concurrency import ConcurrencyController
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
@@ -9,11 +10,13 @@ class Crawler(object):
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
+        self.controller = ConcurrencyController(config)
 
     def start_async(self):
         self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier)
-            for worker_id in range(self.config.threads_count)]
+            self.worker_factory(
+                worker_id, self.config, self.frontier, self.controller)
+            for worker_id in range(self.controller.max_workers)]
         for worker in self.workers:
             worker.start()
 
@@ -29,3 +32,5 @@ class Crawler(object):
             for worker in self.workers:
                 worker.dump_report()
             raise KeyboardInterrupt;
+        finally:
+            self.frontier.close()
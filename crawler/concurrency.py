@@ -0,0 +1,133 @@
+import time
+
+from collections import deque
+from threading import Condition
+
+from utils import get_logger
+
+# Downloads per decision window.
+WINDOW = 20
+# A window with at least this share of failed downloads is an error burst:
+# halve the workers and pause all of them.
+ERROR_BURST = 0.5
+# Above this share of failures, or with latency this many times the best
+# seen, halve the workers without pausing.
+ERROR_TOLERANCE = 0.1
+LATENCY_FACTOR = 2.0
+# The latency baseline is the best median of this many recent windows, so
+# one fast window does not make every later window look slow.
+BASELINE_WINDOWS = 10
+MIN_BACKOFF = 5.0
+MAX_BACKOFF = 120.0
+
+
+class ConcurrencyController(object):
+    ''' AIMD control of how many workers may download at once.
+
+    The crawler starts MAXTHREADS workers; only the first `limit` of the
+    workers still running may download. Every WINDOW downloads the
+    controller looks at the failure rate (exceptions, timeouts and 5xx/6xx
+    statuses) and median latency, compared with the best median of the last
+    BASELINE_WINDOWS windows: a healthy window adds one worker, a degraded
+    one halves the limit and an error burst also pauses every worker for an
+    exponentially growing backoff.'''
+    def __init__(self, config):
+        self.logger = get_logger("CONCURRENCY", "CRAWLER")
+        self.min_workers = config.min_threads
+        self.max_workers = config.max_threads
+        self.limit = min(
+            self.max_workers, max(self.min_workers, config.threads_count))
+        self.condition = Condition()
+        self.latencies = list()
+        self.failures = 0
+        self.recent_latencies = deque(maxlen=BASELINE_WINDOWS)
+        self.backoff = MIN_BACKOFF
+        self.paused_until = 0.0
+        self.draining = False
+        # Workers currently holding a url.
+        self.busy = 0
+        # Ids of the workers still running. The first `limit` of them are
+        # active, so a worker that dies hands its slot to the next one.
+        self.live = list(range(self.max_workers))
+
+    def wait_turn(self, worker_id):
+        ''' Block while this worker is switched off or a backoff is active. '''
+        with self.condition:
+            while not self.draining:
+                pause = self.paused_until - time.time()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.live.index(worker_id) >= self.limit:
+                    self.condition.wait()
+                else:
+                    return
+
+    def worker_exited(self, worker_id):
+        ''' Give up the worker's slot, called whenever a worker stops. '''
+        with self.condition:
+            if worker_id in self.live:
+                self.live.remove(worker_id)
+            self.condition.notify_all()
+
+    def start_page(self):
+        with self.condition:
+            self.busy += 1
+
+    def finish_page(self):
+        with self.condition:
+            self.busy -= 1
+            self.condition.notify_all()
+
+    def wait_for_work(self, timeout=1.0):
+        ''' Called with an empty frontier. False if no worker is busy, so
+        no new urls can appear, otherwise waits a little and returns True. '''
+        with self.condition:
+            if self.busy == 0 or self.draining:
+                return False
+            self.condition.wait(timeout)
+            return True
+
+    def drain(self):
+        ''' Wake every waiting worker, used once the frontier runs dry. '''
+        with self.condition:
+            self.draining = True
+            self.condition.notify_all()
+
+    def record(self, latency, status=None, error=False):
+        with self.condition:
+            self.latencies.append(latency)
+            if error or status is None or status >= 500:
+                self.failures += 1
+            if len(self.latencies) >= WINDOW:
+                self._decide()
+
+    def _decide(self):
+        count = len(self.latencies)
+        error_rate = self.failures / count
+        median = sorted(self.latencies)[count // 2]
+        self.latencies = list()
+        self.failures = 0
+        if error_rate < ERROR_TOLERANCE:
+            self.recent_latencies.append(median)
+        baseline = min(self.recent_latencies, default=None)
+        slow = median > LATENCY_FACTOR * baseline if baseline else False
+
+        old_limit = self.limit
+        if error_rate >= ERROR_BURST:
+            self.limit = max(self.min_workers, self.limit // 2)
+            self.paused_until = time.time() + self.backoff
+            decision = f"error burst, pausing {self.backoff:.0f}s"
+            self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+        elif error_rate > ERROR_TOLERANCE or slow:
+            self.limit = max(self.min_workers, self.limit // 2)
+            decision = "degraded"
+        else:
+            self.limit = min(self.max_workers, self.limit + 1)
+            self.backoff = MIN_BACKOFF
+            decision = "healthy"
+        self.logger.info(
+            f"Concurrency {old_limit} -> {self.limit} "
+            f"(min {self.min_workers}, max {self.max_workers}): {decision}, "
+            f"{count} downloads, median {median * 1000:.0f}ms, "
+            f"{error_rate:.0%} failed.")
+        self.condition.notify_all()
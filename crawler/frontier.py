@@ -1,17 +1,42 @@
 import os
 import shelve
+import time
 
 from threading import Thread, RLock
 from queue import Queue, Empty
+from urllib.parse import urlparse
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils import get_logger, get_urlhash, canonicalize
+from utils import canonical, robots
+import scraper
+from scraper import is_valid, is_trap_url, is_event_date_url
+from crawler.page_store import PageStore
+from crawler.spill_queue import SpillQueue
+
+# How many of the most recently queued urls get_tbd_url compares by
+# in-degree when picking the next url.
+PRIORITY_WINDOW = 32
+# Failed downloads of a url before it is given up on.
+MAX_RETRIES = 3
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
+        self.lock = RLock()
+        # Earliest time the next request to each host may be sent.
+        self.next_fetch = dict()
+        # Background threads still reading a new host's sitemaps.
+        self.sitemap_readers = 0
+        # Urls handed to a worker and not completed yet, put back in the
+        # queue by close() so the checkpoint does not lose them.
+        self.in_flight = set()
+        # Failed download attempts per url in this run.
+        self.retries = dict()
+        self.robots = robots.RobotsCache(
+            config, self.logger, wait=self.wait_politeness)
+        robots.set_active(self.robots)
+        canonical.configure(config.strip_params)
         
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -25,15 +50,37 @@ class Frontier(object):
             os.remove(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
         self.save = shelve.open(self.config.save_file)
+        # Pending urls, mostly on disk. Restored as is after a clean
+        # shutdown, otherwise rebuilt from the save file.
+        self.to_be_downloaded = SpillQueue(
+            f"{self.config.save_file}.queue", reset=restart)
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
+        elif self.to_be_downloaded.restored:
+            self.logger.info(
+                f"Restored {len(self.to_be_downloaded)} queued urls.")
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
             if not self.save:
                 for url in self.config.seed_urls:
                     self.add_url(url)
+        self.pages = PageStore(config, restart)
+        if self.config.incremental:
+            self._queue_revisits()
+
+    def _queue_revisits(self):
+        ''' Put completed urls that are due for a revisit back in the queue. '''
+        due_count = 0
+        for url in self.pages.due_urls():
+            urlhash = get_urlhash(url)
+            if urlhash in self.save and self.save[urlhash][1] and is_valid(url):
+                self.save[urlhash] = (url, False)
+                self.to_be_downloaded.push(url)
+                due_count += 1
+        self.save.sync()
+        self.logger.info(f"Queued {due_count} urls due for a revisit.")
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
@@ -41,32 +88,126 @@ class Frontier(object):
         tbd_count = 0
         for url, completed in self.save.values():
             if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
+                self.to_be_downloaded.push(url)
                 tbd_count += 1
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        ''' Pop the best linked url among the last PRIORITY_WINDOW queued. '''
+        # The link graph is opened by scraper.load_all.
+        if scraper.link_graph is None:
+            url = self.to_be_downloaded.pop()
+        else:
+            url = self.to_be_downloaded.pop(
+                key=scraper.link_graph.in_degree_of, window=PRIORITY_WINDOW)
+        if url:
+            with self.lock:
+                self.in_flight.add(url)
+        return url
 
     def add_url(self, url):
-        url = normalize(url)
+        ''' Queue url if it is new and allowed, returns True if it was. '''
+        url = canonicalize(url)
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
+        with self.lock:
+            if urlhash in self.save:
+                return False
+        new_host = not self.robots.is_cached(url)
+        # Can download robots.txt, so it must not hold up the other workers.
+        if not self.robots.can_fetch(url):
+            self.logger.info(f"Skipping {url}, disallowed by robots.txt.")
+            return False
+        with self.lock:
+            if urlhash in self.save:
+                return False
             self.save[urlhash] = (url, False)
             self.save.sync()
-            self.to_be_downloaded.append(url)
+            self.to_be_downloaded.push(url)
+        if new_host:
+            # Sitemaps take several politeness waits to read, so they are
+            # read on their own thread instead of holding up the worker.
+            with self.lock:
+                self.sitemap_readers += 1
+            Thread(
+                target=self._seed_from_sitemaps, args=(url,), daemon=True).start()
+        return True
+
+    def reading_sitemaps(self):
+        ''' True while sitemap urls may still be added to the queue. '''
+        with self.lock:
+            return self.sitemap_readers > 0
+
+    def _seed_from_sitemaps(self, url):
+        try:
+            added = 0
+            for sitemap_url in self.robots.sitemap_urls(url):
+                sitemap_url = canonicalize(sitemap_url)
+                # Same filters as links found on pages, sitemaps often list
+                # every single calendar day.
+                if (is_valid(sitemap_url) and not is_trap_url(sitemap_url)
+                        and not is_event_date_url(sitemap_url)
+                        and self.add_url(sitemap_url)):
+                    added += 1
+            if added:
+                self.logger.info(f"Seeded {added} urls from sitemaps of {url}.")
+        except Exception as e:
+            self.logger.exception(e)
+        finally:
+            with self.lock:
+                self.sitemap_readers -= 1
+
+    def wait_politeness(self, url):
+        ''' Block until a request to the url's host is allowed.
+
+        The delay is the configured POLITENESS, or the host's robots.txt
+        Crawl-delay if that is longer. Slots are reserved under the lock so
+        concurrent workers never hit the same host closer than the delay.'''
+        host = urlparse(url).netloc.lower()
+        delay = max(self.config.time_delay, self.robots.crawl_delay(url))
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_fetch.get(host, 0))
+            self.next_fetch[host] = slot + delay
+        if slot > now:
+            time.sleep(slot - now)
     
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+        with self.lock:
+            if urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+            self.save[urlhash] = (url, True)
+            self.save.sync()
+            self.in_flight.discard(url)
+
+    def retry_url(self, url):
+        ''' Queue a url whose download failed again, up to MAX_RETRIES
+        times, then give up on it and mark it complete. '''
+        with self.lock:
+            self.retries[url] = self.retries.get(url, 0) + 1
+            if self.retries[url] > MAX_RETRIES:
+                self.logger.error(
+                    f"Giving up on {url} after {MAX_RETRIES} retries.")
+                self.mark_url_complete(url)
+                return
+            self.in_flight.discard(url)
+            self.to_be_downloaded.push(url)
+
+    def close(self):
+        ''' Checkpoint the queue so the next run can restore it directly.
+        Urls still in flight, from interrupted or failed workers, are queued
+        again first. '''
+        with self.lock:
+            for url in self.in_flight:
+                self.to_be_downloaded.push(url)
+            if self.in_flight:
+                self.logger.info(
+                    f"Queued {len(self.in_flight)} unfinished urls again.")
+            self.in_flight = set()
+            self.to_be_downloaded.close()
+            self.save.sync()
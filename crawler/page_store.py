@@ -0,0 +1,122 @@
+import math
+import os
+import shelve
+import time
+
+from hashlib import sha256
+from threading import RLock
+
+from utils import get_logger, get_urlhash
+
+# Revisit interval for pages fetched only once, in seconds.
+DEFAULT_REVISIT = 24 * 60 * 60
+MIN_REVISIT = 60 * 60
+MAX_REVISIT = 30 * 24 * 60 * 60
+
+
+def content_digest(resp):
+    if resp.raw_response is None:
+        return None
+    return sha256(resp.raw_response.content).hexdigest()
+
+
+def _header(resp, name):
+    if resp.raw_response is None:
+        return None
+    return resp.raw_response.headers.get(name)
+
+
+def estimate_interval(visits, changes, observed):
+    """Revisit interval from the estimated change rate of a page.
+
+    Uses the Cho/Garcia-Molina estimator for pages polled at (roughly)
+    regular intervals: r = -log((n - X + 0.5) / (n + 0.5)) / I, where n is
+    the number of revisits, X the number of revisits that found a change
+    and I the mean interval between visits. The next visit is 1/r away."""
+    if visits == 0 or observed <= 0:
+        return DEFAULT_REVISIT
+    mean_interval = observed / visits
+    rate = -math.log((visits - changes + 0.5) / (visits + 0.5)) / mean_interval
+    if rate <= 0:
+        return MAX_REVISIT
+    return min(MAX_REVISIT, max(MIN_REVISIT, 1 / rate))
+
+
+class PageStore(object):
+    ''' Per url fetch history used for incremental re-crawls.
+
+    Keeps the last status, content digest, ETag/Last-Modified and fetch time
+    of every downloaded url, the page's contribution to the analytics (so it
+    can be subtracted when the page changes) and its revisit schedule.'''
+    def __init__(self, config, restart):
+        self.logger = get_logger("PAGESTORE", "FRONTIER")
+        self.lock = RLock()
+        if restart and os.path.exists(config.page_store_file):
+            self.logger.info(
+                f"Found page store {config.page_store_file}, deleting it.")
+            os.remove(config.page_store_file)
+        self.save = shelve.open(config.page_store_file)
+
+    def get(self, url):
+        with self.lock:
+            return self.save.get(get_urlhash(url))
+
+    def is_unchanged(self, url, resp):
+        ''' True if resp carries the same page as the last fetch of url. '''
+        record = self.get(url)
+        if record is None or record["status"] != resp.status:
+            return False
+        etag = _header(resp, "ETag")
+        if etag and etag == record["etag"]:
+            return True
+        last_modified = _header(resp, "Last-Modified")
+        if last_modified and last_modified == record["last_modified"]:
+            return True
+        digest = content_digest(resp)
+        return digest is not None and digest == record["digest"]
+
+    def contribution(self, url):
+        record = self.get(url)
+        return record["contribution"] if record else None
+
+    def record_fetch(self, url, resp, changed, contribution=None):
+        now = time.time()
+        urlhash = get_urlhash(url)
+        with self.lock:
+            record = self.save.get(urlhash)
+            if record is None:
+                record = {
+                    "url": url, "visits": 0, "changes": 0, "observed": 0.0,
+                    "contribution": None}
+            else:
+                record["visits"] += 1
+                record["changes"] += 1 if changed else 0
+                record["observed"] += now - record["fetched"]
+            record["status"] = resp.status
+            record["etag"] = _header(resp, "ETag")
+            record["last_modified"] = _header(resp, "Last-Modified")
+            record["digest"] = content_digest(resp)
+            record["fetched"] = now
+            record["interval"] = estimate_interval(
+                record["visits"], record["changes"], record["observed"])
+            if changed:
+                record["contribution"] = contribution
+            self.save[urlhash] = record
+            self.save.sync()
+
+    def due_urls(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for record in self.save.values():
+                if record["fetched"] + record["interval"] <= now:
+                    yield record["url"]
+
+    def longest_page(self):
+        ''' (url, word_count) of the longest page in the store. '''
+        url, word_count = "", 0
+        with self.lock:
+            for record in self.save.values():
+                contribution = record["contribution"]
+                if contribution and contribution["word_count"] > word_count:
+                    url, word_count = record["url"], contribution["word_count"]
+        return url, word_count
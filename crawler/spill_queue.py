@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import struct
+
+from collections import deque
+from threading import RLock
+
+# Urls kept in memory at the front of the queue.
+HEAD_SIZE = 10000
+# Urls per spilled segment file, also the size of a refill.
+SEGMENT_SIZE = 10000
+
+_LENGTH = struct.Struct("<I")
+
+
+def write_urls(path, urls):
+    ''' Write urls as length-prefixed UTF-8 records. '''
+    with open(path, "wb") as f:
+        for url in urls:
+            data = url.encode("utf-8")
+            f.write(_LENGTH.pack(len(data)))
+            f.write(data)
+
+
+def read_urls(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    urls = list()
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        urls.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+    return urls
+
+
+class SpillQueue(object):
+    ''' Url queue with a bounded in-memory head and the rest on disk.
+
+    Urls are popped from the head, newest first. Once the head is full new
+    urls collect in a tail buffer that is written out as a segment file
+    every SEGMENT_SIZE urls. When the head runs dry it is refilled with the
+    oldest segment. Memory use is bounded by HEAD_SIZE + SEGMENT_SIZE urls
+    whatever the queue length.
+
+    close() writes the in-memory urls to disk and marks the directory clean,
+    so the next run restores the queue without rescanning the save file. A
+    push after close(), from a thread still running, marks it dirty again.
+    `restored` is False if there was no clean queue to restore.'''
+    def __init__(self, directory, reset=False, head_size=HEAD_SIZE,
+                 segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.head_size = head_size
+        self.segment_size = segment_size
+        self.lock = RLock()
+        self.head = list()
+        self.tail = list()
+        # (segment number, url count), oldest first.
+        self.segments = deque()
+        self.next_segment = 0
+        self.closed = False
+        self.restored = not reset and self._restore()
+        if not self.restored and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self._write_state(clean=False)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _restore(self):
+        try:
+            with open(self._path("state.json"), "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if not state["clean"]:
+            return False
+        self.segments = deque(tuple(segment) for segment in state["segments"])
+        self.next_segment = state["next_segment"]
+        for url in read_urls(self._path("head.bin")):
+            self.push(url)
+        return True
+
+    def _write_state(self, clean):
+        with open(self._path("state.json"), "w") as f:
+            json.dump({
+                "clean": clean, "next_segment": self.next_segment,
+                "segments": list(self.segments)}, f)
+
+    def __len__(self):
+        return (
+            len(self.head) + len(self.tail)
+            + sum(count for _, count in self.segments))
+
+    def push(self, url):
+        with self.lock:
+            if self.closed:
+                # Too late for the checkpoint, so make the next run rebuild
+                # the queue from the save file instead.
+                self.closed = False
+                self._write_state(clean=False)
+            if len(self.head) < self.head_size:
+                self.head.append(url)
+                return
+            self.tail.append(url)
+            if len(self.tail) >= self.segment_size:
+                self._spill()
+
+    def _spill(self):
+        number = self.next_segment
+        write_urls(self._path(f"seg-{number:06d}.bin"), self.tail)
+        self.segments.append((number, len(self.tail)))
+        self.next_segment += 1
+        self.tail = list()
+        self._write_state(clean=False)
+
+    def _refill(self):
+        if self.segments:
+            number, _ = self.segments.popleft()
+            path = self._path(f"seg-{number:06d}.bin")
+            self.head = read_urls(path)
+            os.remove(path)
+            self._write_state(clean=False)
+        elif self.tail:
+            self.head, self.tail = self.tail, list()
+
+    def pop(self, key=None, window=1):
+        ''' Pop the newest url, or the one with the highest key among the
+        newest `window` urls. Returns None when the queue is empty. '''
+        with self.lock:
+            if not self.head:
+                self._refill()
+            head = self.head
+            if not head:
+                return None
+            if key is not None and window > 1:
+                start = max(0, len(head) - window)
+                best = max(range(len(head) - 1, start - 1, -1),
+                           key=lambda i: key(head[i]))
+                head[best], head[-1] = head[-1], head[best]
+            return head.pop()
+
+    def close(self):
+        with self.lock:
+            write_urls(self._path("head.bin"), self.head + self.tail)
+            self._write_state(clean=True)
+            self.closed = True
@@ -1,44 +1,131 @@
-from threading import Thread
+from threading import Thread, Lock
 
+from contextlib import contextmanager
 from inspect import getsource
+from requests import RequestException
 from utils.download import download
 from utils import get_logger
 import scraper
 import time
 
+# scraper.py keeps its analytics in module globals, one page at a time.
+SCRAPER_LOCK = Lock()
+
+
+@contextmanager
+def scraper_lock():
+    ''' Hold SCRAPER_LOCK. Acquired in its own frame so the profiler can tell
+    waiting for the lock apart from the work done under it. '''
+    SCRAPER_LOCK.acquire()
+    try:
+        yield
+    finally:
+        SCRAPER_LOCK.release()
+
 
 class Worker(Thread):
-    def __init__(self, worker_id, config, frontier):
+    def __init__(self, worker_id, config, frontier, controller=None):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
+        self.worker_id = worker_id
         self.config = config
         self.frontier = frontier
+        self.controller = controller
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
         assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
         super().__init__(daemon=True)
 
     def dump_report(self):
-        scraper.save_all()
-        
+        with scraper_lock():
+            scraper.save_all()
+            scraper.flush_stores()
+
+    def _download(self, url):
+        ''' Download url, reporting latency and failures to the controller.
+        Returns None if the cache server could not be reached. '''
+        start = time.monotonic()
+        try:
+            resp = download(url, self.config, self.logger)
+        except RequestException as e:
+            if self.controller:
+                self.controller.record(time.monotonic() - start, error=True)
+            self.logger.error(f"Failed to download {url}: {e}")
+            return None
+        if self.controller:
+            self.controller.record(time.monotonic() - start, resp.status)
+        return resp
+
+    def _crawl(self, tbd_url):
+        self.frontier.wait_politeness(tbd_url)
+        resp = self._download(tbd_url)
+        if resp is None:
+            self.frontier.retry_url(tbd_url)
+            return
+        self.logger.info(
+            f"Downloaded {tbd_url}, status <{resp.status}>, "
+            f"using cache {resp.cache_server}.")
+        pages = self.frontier.pages
+        if pages.is_unchanged(tbd_url, resp):
+            # Same content as the last crawl, nothing to re-parse.
+            self.logger.info(f"Unchanged {tbd_url}, skipping.")
+            pages.record_fetch(tbd_url, resp, changed=False)
+            self.frontier.mark_url_complete(tbd_url)
+            return
+        with scraper_lock():
+            previous = pages.contribution(tbd_url)
+            lost_longest = (
+                previous is not None
+                and scraper.retract_page(tbd_url, previous))
+            scraped_urls = scraper.scraper(tbd_url, resp)
+            pages.record_fetch(
+                tbd_url, resp, changed=True,
+                contribution=scraper.last_contribution())
+            if lost_longest:
+                scraper.restore_longest_page(*pages.longest_page())
+            scraper.page_done()
+        for scraped_url in scraped_urls:
+            self.frontier.add_url(scraped_url)
+        self.frontier.mark_url_complete(tbd_url)
+
     def run(self):
         scraper.load_all()
+        profiler = self.config.profiler
+        if profiler:
+            profiler.register(self.worker_id)
         try:
             while True:
+                if self.controller:
+                    self.controller.wait_turn(self.worker_id)
+                    self.controller.start_page()
                 tbd_url = self.frontier.get_tbd_url()
                 if not tbd_url:
-                    scraper.save_all()
+                    # Other workers or sitemap readers may still be adding
+                    # links.
+                    if self.controller:
+                        self.controller.finish_page()
+                        if self.controller.wait_for_work():
+                            continue
+                    if self.frontier.reading_sitemaps():
+                        time.sleep(1)
+                        continue
+                    if self.controller:
+                        self.controller.drain()
+                    self.dump_report()
                     self.logger.info("Frontier is empty. Stopping Crawler.")
                     break
-                resp = download(tbd_url, self.config, self.logger)
-                self.logger.info(
-                    f"Downloaded {tbd_url}, status <{resp.status}>, "
-                    f"using cache {self.config.cache_server}.")
-                scraped_urls = scraper.scraper(tbd_url, resp)
-                for scraped_url in scraped_urls:
-                    self.frontier.add_url(scraped_url)
-                self.frontier.mark_url_complete(tbd_url)
-                time.sleep(self.config.time_delay)
+                try:
+                    self._crawl(tbd_url)
+                finally:
+                    if self.controller:
+                        self.controller.finish_page()
+                if profiler:
+                    profiler.page_done(self.worker_id)
         except Exception as e:
-            scraper.save_all()
+            self.dump_report()
             self.logger.exception(e)
             raise e
+        finally:
+            if self.controller:
+                self.controller.worker_exited(self.worker_id)
+            if profiler:
+                profiler.unregister(self.worker_id)
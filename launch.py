@@ -1,13 +1,17 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser
 import os
+import shutil
 
 from utils.server_registration import get_cache_server
 from utils.config import Config
+from utils.cache_pool import CachePool, parse_endpoints
+from utils import get_logger
+from utils.profiling import Profiler
 from crawler import Crawler
 
 # Main function to start the crawler
-def main(config_file, restart):
+def main(config_file, restart, incremental=False, profiler=None):
     # If restart flag is set, remove existing report and data files
     if restart:
         if os.path.exists("report.txt"):
@@ -26,22 +30,53 @@ def main(config_file, restart):
             os.remove("cache/exact_page_hashes.txt")
         if os.path.exists("cache/total_pages.txt"):
             os.remove("cache/total_pages.txt")
+        if os.path.exists("cache/url_ids.txt"):
+            os.remove("cache/url_ids.txt")
+        if os.path.exists("cache/features"):
+            shutil.rmtree("cache/features")
+        if os.path.exists("cache/graph"):
+            shutil.rmtree("cache/graph")
     # Read configuration from the config file
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
+    config.incremental = incremental
+    config.profiler = profiler
     # Get cache server based on the configuration
-    config.cache_server = get_cache_server(config, restart)
+    if config.cache_servers:
+        endpoints = parse_endpoints(config.cache_servers)
+    else:
+        endpoints = parse_endpoints(get_cache_server(config, restart))
+    config.cache_server = endpoints[0]
+    config.cache_pool = CachePool(
+        endpoints, config.cache_routing, get_logger("CRAWLER"))
     # Initialize and start the crawler
     crawler = Crawler(config, restart)
+    if profiler:
+        profiler.start()
     crawler.start()
 
 # Entry point of the script
 if __name__ == "__main__":
     # Parse command line arguments
     parser = ArgumentParser()
-    parser.add_argument("--restart", action="store_true", default=False)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--restart", action="store_true", default=False)
+    # Keep all progress and re-crawl pages that are due for a revisit
+    mode.add_argument("--incremental", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    # Profile the workers for a bounded window, output goes to Logs/profile
+    parser.add_argument(
+        "--profile", choices=["sampling", "cprofile"], nargs="?",
+        const="sampling", default=None)
+    parser.add_argument("--profile_pages", type=int, default=200)
+    parser.add_argument("--profile_seconds", type=float, default=120.0)
+    parser.add_argument("--profile_memory", action="store_true", default=False)
     args = parser.parse_args()
+    profiler = None
+    if args.profile:
+        profiler = Profiler(
+            args.profile_pages, args.profile_seconds,
+            cprofile=args.profile == "cprofile", memory=args.profile_memory)
     # Call the main function with parsed arguments
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.incremental, profiler)
@@ -0,0 +1,234 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+
+import numpy as np
+
+from utils import csr_graph
+from utils.feature_store import (
+    FEATURES_DIR, URL_IDS_FILE, ACCEPTED, RETRACTED)
+from utils.ids import load_strings
+from utils.link_graph import GRAPH_DIR
+
+PAGE_COLUMNS = ("url_id", "host_id", "flags", "word_count", "outlinks")
+
+
+def list_segments(directory):
+    if not os.path.exists(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith("seg-"))
+
+
+def load_columns(segment, columns):
+    with open(os.path.join(segment, "meta.json"), "r") as f:
+        dtypes = json.load(f)["columns"]
+    return {
+        column: np.fromfile(os.path.join(segment, column), dtype=dtypes[column])
+        for column in columns}
+
+
+def segment_pages(segment):
+    return load_columns(segment, PAGE_COLUMNS)
+
+
+def segment_word_totals(args):
+    ''' Word id -> total count over the kept rows of one segment. '''
+    segment, keep, vocab_size = args
+    columns = load_columns(segment, ("word_ends", "word_ids", "word_counts"))
+    lengths = np.diff(columns["word_ends"], prepend=0).astype(np.int64)
+    entry_keep = np.repeat(keep, lengths)
+    return np.bincount(
+        columns["word_ids"][entry_keep],
+        weights=columns["word_counts"][entry_keep],
+        minlength=vocab_size).astype(np.int64)
+
+
+def latest_rows(url_ids):
+    ''' Mask of the last row of every url, rows are in append order. '''
+    _, first_from_end = np.unique(url_ids[::-1], return_index=True)
+    mask = np.zeros(len(url_ids), dtype=bool)
+    mask[len(url_ids) - 1 - first_from_end] = True
+    return mask
+
+
+def default_url_ids(features_dir):
+    ''' The url id file sits next to the features directory. '''
+    return os.path.join(
+        os.path.dirname(os.path.normpath(features_dir)),
+        os.path.basename(URL_IDS_FILE))
+
+
+def check_url_ids(max_id, urls, url_ids_file):
+    if max_id >= len(urls):
+        raise ValueError(
+            f"{url_ids_file} has {len(urls)} urls, but the store refers to "
+            f"url id {max_id}. Pass the matching file with --url_ids.")
+
+
+def is_ics_subdomain(host):
+    return "ics.uci.edu" in host and "informatics.uci.edu" not in host
+
+
+def compute_report(directory=FEATURES_DIR, url_ids_file=URL_IDS_FILE,
+                   workers=None):
+    segments = list_segments(directory)
+    urls = load_strings(url_ids_file)
+    hosts = load_strings(os.path.join(directory, "hosts.txt"))
+    words = load_strings(os.path.join(directory, "words.txt"))
+    report = {
+        "total_pages": 0, "accepted_pages": 0, "skipped_pages": 0,
+        "longest_page": ("", 0), "top_words": [], "subdomains": {},
+        "vocabulary": len(words), "word_count_percentiles": {},
+        "mean_outlinks": 0.0, "top_hosts": []}
+    if not segments:
+        return report
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(segment_pages, segments))
+        pages = {
+            column: np.concatenate([part[column] for part in parts])
+            for column in PAGE_COLUMNS}
+        latest = latest_rows(pages["url_id"])
+        counted = latest & (pages["flags"] != RETRACTED)
+        accepted = latest & (pages["flags"] == ACCEPTED)
+        check_url_ids(int(pages["url_id"].max()), urls, url_ids_file)
+        bounds = np.cumsum([0] + [len(part["url_id"]) for part in parts])
+        word_totals = np.zeros(len(words), dtype=np.int64)
+        for totals in pool.map(segment_word_totals, [
+                (segment, accepted[start:end], len(words))
+                for segment, start, end in zip(segments, bounds, bounds[1:])]):
+            word_totals += totals
+
+    report["total_pages"] = int(counted.sum())
+    report["accepted_pages"] = int(accepted.sum())
+    report["skipped_pages"] = report["total_pages"] - report["accepted_pages"]
+
+    word_count = np.where(accepted, pages["word_count"], 0)
+    if report["accepted_pages"]:
+        longest = int(np.argmax(word_count))
+        report["longest_page"] = (
+            urls[pages["url_id"][longest]], int(word_count[longest]))
+        accepted_counts = pages["word_count"][accepted]
+        report["word_count_percentiles"] = {
+            p: float(v) for p, v in zip(
+                (50, 90, 99), np.percentile(accepted_counts, (50, 90, 99)))}
+        report["mean_outlinks"] = float(pages["outlinks"][accepted].mean())
+
+    top = min(50, int(np.count_nonzero(word_totals)))
+    if top:
+        top_ids = np.argpartition(-word_totals, top - 1)[:top]
+        top_ids = top_ids[np.lexsort((top_ids, -word_totals[top_ids]))]
+        report["top_words"] = [
+            (words[i], int(word_totals[i])) for i in top_ids]
+
+    host_pages = np.bincount(pages["host_id"][counted], minlength=len(hosts))
+    report["subdomains"] = {
+        hosts[i]: int(host_pages[i])
+        for i in sorted(np.nonzero(host_pages)[0], key=lambda i: hosts[i])
+        if is_ics_subdomain(hosts[i])}
+    busiest = np.argsort(-host_pages, kind="stable")[:10]
+    report["top_hosts"] = [
+        (hosts[i], int(host_pages[i])) for i in busiest if host_pages[i]]
+    return report
+
+
+def url_hosts(urls):
+    ''' (host id per url id, host names) with hosts as scheme://netloc. '''
+    names = np.array(["/".join(url.split("/", 3)[:3]) for url in urls])
+    if not len(names):
+        return np.zeros(0, dtype=np.int64), []
+    hosts, host_of = np.unique(names, return_inverse=True)
+    return host_of, list(hosts)
+
+
+def top_urls(values, urls, count=10):
+    best = np.argsort(-values, kind="stable")[:count]
+    return [(urls[i], values[i].item()) for i in best if values[i] > 0]
+
+
+def compute_graph_report(directory=GRAPH_DIR, url_ids_file=URL_IDS_FILE):
+    urls = load_strings(url_ids_file)
+    if not urls or not os.path.exists(os.path.join(directory, "edges.bin")):
+        return None
+    graph = csr_graph.compact(directory, nodes=len(urls))
+    check_url_ids(graph.nodes - 1, urls, url_ids_file)
+    host_of, hosts = url_hosts(urls)
+    outgoing, incoming, internal = graph.host_links(host_of)
+    return {
+        "nodes": graph.nodes, "edges": graph.edges,
+        "top_in_degree": top_urls(graph.in_degree(), urls),
+        "top_pagerank": top_urls(graph.pagerank(), urls),
+        "subdomain_links": {
+            hosts[i]: (int(outgoing[i]), int(incoming[i]), int(internal[i]))
+            for i in range(len(hosts)) if is_ics_subdomain(hosts[i])}}
+
+
+def write_graph_report(report, f):
+    f.write(f"Link graph: {report['nodes']} urls, {report['edges']} links\n")
+    f.write("Top 10 pages by in-degree:\n")
+    for url, value in report["top_in_degree"]:
+        f.write(f"{url}, {value}\n")
+    f.write("Top 10 pages by PageRank:\n")
+    for url, value in report["top_pagerank"]:
+        f.write(f"{url}, {value:.6f}\n")
+    f.write("Links per subdomain in ics.uci.edu (outgoing, incoming, internal):\n")
+    for subdomain, (outgoing, incoming, internal) in (
+            report["subdomain_links"].items()):
+        f.write(f"{subdomain}, {outgoing}, {incoming}, {internal}\n")
+
+
+def write_report(report, f):
+    # Same layout as scraper.dump_report, followed by the extra statistics.
+    url, word_count = report["longest_page"]
+    f.write(f"Total pages: {report['total_pages']}\n")
+    f.write(f"Longest page: {url} with {word_count} words\n")
+    f.write("Top 50 words:\n")
+    for word, count in report["top_words"]:
+        f.write(f"{word}: {count}\n")
+    f.write("Subdomains in ics.uci.edu:\n")
+    for subdomain, count in report["subdomains"].items():
+        f.write(f"{subdomain}, {count}\n")
+    f.write(f"Accepted pages: {report['accepted_pages']}\n")
+    f.write(f"Skipped pages: {report['skipped_pages']}\n")
+    f.write(f"Vocabulary size: {report['vocabulary']}\n")
+    for p, value in report["word_count_percentiles"].items():
+        f.write(f"Words per page p{p}: {value:.1f}\n")
+    f.write(f"Mean outlinks per page: {report['mean_outlinks']:.2f}\n")
+    f.write("Top 10 hosts by pages:\n")
+    for host, count in report["top_hosts"]:
+        f.write(f"{host}, {count}\n")
+
+
+def main(features_dir, graph_dir, output, workers, url_ids_file=None):
+    if url_ids_file is None:
+        url_ids_file = default_url_ids(features_dir)
+    try:
+        report = compute_report(features_dir, url_ids_file, workers)
+        graph_report = compute_graph_report(graph_dir, url_ids_file)
+    except ValueError as e:
+        sys.exit(f"report.py: error: {e}")
+    f = sys.stdout if output == "-" else open(output, "w")
+    try:
+        write_report(report, f)
+        if graph_report:
+            write_graph_report(graph_report, f)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Build the crawl report offline from the feature store.")
+    parser.add_argument("--features", type=str, default=FEATURES_DIR)
+    parser.add_argument("--graph", type=str, default=GRAPH_DIR)
+    parser.add_argument("--output", type=str, default="-")
+    parser.add_argument("--workers", type=int, default=None)
+    # Defaults to url_ids.txt next to the features directory
+    parser.add_argument("--url_ids", type=str, default=None)
+    args = parser.parse_args()
+    main(args.features, args.graph, args.output, args.workers, args.url_ids)
@@ -2,14 +2,23 @@ import re
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
 from collections import Counter
+from hashlib import blake2b
 from stopwords import stop_words
+from utils import robots, get_logger, log_page_event, canonicalize
+from utils.feature_store import FeatureWriter, SKIPPED, URL_IDS_FILE
+from utils.ids import IdMap
+from utils.link_graph import EdgeLog
 import json
+import threading
+import time
 import nltk
 import lxml
 from nltk.corpus import words as nltk_words
 
 nltk.download("words")
 
+logger = get_logger("SCRAPER")
+
 # Global variables
 total_pages = int(0)
 
@@ -33,6 +42,53 @@ exact_page_hashes = set()
 
 MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10 MB
 
+# What the page being scraped added to the globals above, kept per thread so
+# it can be stored and subtracted again when the page is re-crawled.
+_current_page = threading.local()
+
+# Url ids shared by the feature store and the link graph. These are opened
+# by load_all, after launch.py has removed them on --restart.
+url_ids = None
+
+# Append-only per page features, read offline by report.py
+features = None
+
+# Every link seen between valid pages, as url id pairs
+link_graph = None
+
+# Buffered features and edges are written out at least this often, so a
+# crash loses at most this much of the offline data.
+FLUSH_PAGES = 500
+FLUSH_SECONDS = 60
+_pages_since_flush = 0
+_last_flush = time.monotonic()
+
+
+def open_stores():
+    global url_ids, features, link_graph
+    url_ids = IdMap(URL_IDS_FILE)
+    features = FeatureWriter(url_ids=url_ids)
+    link_graph = EdgeLog(url_ids)
+
+
+def flush_stores():
+    global _pages_since_flush, _last_flush
+    if features is None:
+        return
+    features.flush()
+    link_graph.flush()
+    _pages_since_flush = 0
+    _last_flush = time.monotonic()
+
+
+def page_done():
+    """Called after every scraped page, flushes the stores now and then"""
+    global _pages_since_flush
+    _pages_since_flush += 1
+    if (_pages_since_flush >= FLUSH_PAGES
+            or time.monotonic() - _last_flush >= FLUSH_SECONDS):
+        flush_stores()
+
 
 def save_all():
     save_longest_page()
@@ -44,19 +100,32 @@ def save_all():
     dump_report()
 
 
+_load_lock = threading.Lock()
+_loaded = False
+
+
 def load_all():
+    # Every worker calls this, only the first one loads.
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return
+        _load_all()
+        _loaded = True
+
+
+def _load_all():
+    open_stores()
     load_longest_page()
-    print("loaded longest page")
     load_subdomains()
-    print("loaded subdomains")
     load_page_hashes()
-    print("loaded page hashes")
     load_visited_urls()
-    print("loaded visited urls")
     load_word_frequencies()
-    print("loaded word frequencies")
     load_exact_page_hashes()
     load_total_pages()
+    logger.info(
+        f"Loaded {total_pages} pages, {len(visited_urls)} visited urls, "
+        f"{len(word_counter)} words and {len(subdomains)} subdomains.")
 
 def save_total_pages():
     with open("cache/total_pages.txt", "w") as f:
@@ -138,6 +207,13 @@ def load_visited_urls():
     except FileNotFoundError:
         pass
 
+def stable_hash(text):
+    """64 bit hash of text that is the same in every process, unlike
+    hash(), so it can be persisted and compared across runs"""
+    digest = blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
 def compute_similarity_hash(text, window_size=3):
     """
     Compute a more robust similarity hash using character-level k-grams
@@ -153,7 +229,7 @@ def compute_similarity_hash(text, window_size=3):
     # Create a simple but effective hash
     hash_value = 0
     for gram in k_grams:
-        hash_value ^= hash(gram)
+        hash_value ^= stable_hash(gram)
     return hash_value
 
 # Replace the existing shingle-related code with:
@@ -168,19 +244,9 @@ def are_pages_similar(text1_hash, text2_hash, threshold=0.8):
     return similarity >= threshold
 
 
-def normalize_url(url):
-    """Normalize URL by removing trailing slash"""
-    if url.endswith("/"):
-        return url[:-1]
-    return url
-
-
 def process_urls(urls):
-    """Normalize URLs and remove duplicates"""
-    normalized_urls = set()
-    for url in urls:
-        normalized_urls.add(normalize_url(url))
-    return normalized_urls
+    """Canonicalize URLs and remove duplicates"""
+    return {canonicalize(url) for url in urls}
 
 
 def scraper(url, resp):
@@ -188,6 +254,40 @@ def scraper(url, resp):
     return [link for link in links]
 
 
+def last_contribution():
+    """Contribution of the last page scraped by this thread, or None"""
+    return getattr(_current_page, "contribution", None)
+
+
+def retract_page(url, contribution):
+    """Subtract a previously scraped page from the analytics.
+
+    Returns True if the page was the longest page, in which case the caller
+    has to find the new longest page once the page has been scraped again."""
+    global total_pages
+    if contribution["counted"]:
+        total_pages -= 1
+    subdomain = contribution["subdomain"]
+    if subdomain:
+        subdomains[subdomain] -= 1
+        if subdomains[subdomain] <= 0:
+            del subdomains[subdomain]
+    words = contribution["words"]
+    word_counter.subtract(words)
+    for word in words:
+        if word_counter[word] <= 0:
+            del word_counter[word]
+    page_hashes.discard(contribution["page_hash"])
+    exact_page_hashes.discard(contribution["text_hash"])
+    features.retract(url, page_host(url))
+    return longest_page["url"] == url
+
+
+def restore_longest_page(url, word_count):
+    global longest_page
+    longest_page = {"url": url, "word_count": word_count}
+
+
 def process_page_text(soup):
     """Extract and process text content from the page"""
     text = soup.get_text()
@@ -230,23 +330,36 @@ def is_trap_url(url):
     return False
 
 
+def is_event_date_url(url):
+    """Check if URL is a calendar page for a single date"""
+    parsed_url = urlparse(url)
+    # Paths with /event(s)/ followed by YYYY-MM-DD format dates or date query parameters
+    return bool(re.search(r'/(events|event)/\d{4}-\d{2}-\d{2}', parsed_url.path) or
+                re.search(r'tribe-bar-date=\d{4}-\d{2}-\d{2}', parsed_url.query))
+
+
+def record_link(url, link):
+    """Log a valid link of the page being scraped and count it as an outlink,
+    once per page however often the page repeats it"""
+    if link in _current_page.outlinks:
+        return
+    _current_page.outlinks.add(link)
+    link_graph.add_edge(url, link)
+
+
 def process_link(url, href):
     """Process individual link and return valid URL if any"""
     full_url = urljoin(url, href)
-    parsed_url = urlparse(full_url)
-    defragmented_url = parsed_url._replace(fragment="").geturl()
-    defragmented_url = normalize_url(defragmented_url)
-    # Filter out paths with /event(s)/ followed by YYYY-MM-DD format dates or date query parameters
-    if (re.search(r'/(events|event)/\d{4}-\d{2}-\d{2}', parsed_url.path) or
-        re.search(r'tribe-bar-date=\d{4}-\d{2}-\d{2}', parsed_url.query)):
+    defragmented_url = canonicalize(full_url)
+    if is_event_date_url(full_url):
         return None
-    if (
-        defragmented_url in visited_urls
-        or is_trap_url(defragmented_url)
-        or not is_valid(defragmented_url)
-    ):
+    if defragmented_url in visited_urls:
+        record_link(url, defragmented_url)
+        return None
+    if is_trap_url(defragmented_url) or not is_valid(defragmented_url):
         return None
 
+    record_link(url, defragmented_url)
     visited_urls.add(defragmented_url)
     with open("cache/visited_urls.txt", "a") as f:
         f.write(json.dumps(defragmented_url) + "\n")
@@ -254,6 +367,18 @@ def process_link(url, href):
     return defragmented_url
 
 
+def page_host(url):
+    parsed_url = urlparse(url)
+    return parsed_url.scheme + "://" + parsed_url.netloc
+
+
+def skip_page(url, reason, **fields):
+    """Record a counted page whose content was rejected"""
+    log_page_event("skipped", url, reason=reason, **fields)
+    features.append(url, page_host(url), flags=SKIPPED)
+    return []
+
+
 def is_large_file(resp):
     content_length = resp.raw_response.headers.get('Content-Length')
     if content_length and int(content_length) > MAX_CONTENT_LENGTH:
@@ -263,55 +388,67 @@ def is_large_file(resp):
 
 def extract_next_links(url, resp):
     """Main function to extract links from a page"""
+    _current_page.contribution = None
     if resp.status != 200 or not resp.raw_response.content.strip():
         return []
     
     global total_pages
     total_pages += 1
+    contribution = {
+        "counted": True, "subdomain": None, "words": {}, "word_count": 0,
+        "page_hash": None, "text_hash": None}
+    _current_page.contribution = contribution
 
     parsed_url = urlparse(url)
     if "ics.uci.edu" in parsed_url.netloc and "informatics.uci.edu" not in parsed_url.netloc:
-        subdomain = parsed_url.scheme + "://" + parsed_url.netloc
+        subdomain = page_host(url)
         subdomains[subdomain] += 1
+        contribution["subdomain"] = subdomain
 
     if is_large_file(resp):
-        print(f"Skipping large file: {url}")
-        return []
+        return skip_page(url, "large_file")
 
     soup = BeautifulSoup(resp.raw_response.content, features="lxml")
     text, words = process_page_text(soup)
 
     english_words = filter_words(words)
     if len(english_words) < 50:
-        print(f"Page with little content: {url}")
-        return []
+        return skip_page(url, "little_content", words=len(english_words))
     if len(english_words) < len(words) / 4:
-        print(f"Page with less than 25% English words (low textual content): {url}")
-        return []
+        return skip_page(
+            url, "low_english_ratio",
+            words=len(words), english_words=len(english_words))
 
     # Check for exact duplicate using hash
-    text_hash = hash(text)
+    text_hash = stable_hash(text)
     if text_hash in exact_page_hashes:
-        print(f"Exact duplicate page detected: {url}")
-        return []
+        return skip_page(url, "exact_duplicate")
 
     page_hash = compute_similarity_hash(text)
     for existing_hash in page_hashes:
         if are_pages_similar(page_hash, existing_hash):
-            print(f"Similar page detected: {url}")
-            return []
+            return skip_page(url, "similar_page")
     page_hashes.add(page_hash)
     word_counter.update(english_words)
     exact_page_hashes.add(text_hash)
+    contribution.update({
+        "words": dict(Counter(english_words)), "word_count": len(english_words),
+        "page_hash": page_hash, "text_hash": text_hash})
 
     update_longest_page(url, len(english_words))
 
     links = []
+    _current_page.outlinks = set()
     for a_tag in soup.find_all("a", href=True):
         processed_link = process_link(url, a_tag["href"])
         if processed_link:
             links.append(processed_link)
 
+    log_page_event(
+        "scraped", url, english_words=len(english_words), links=len(links))
+    features.append(
+        url, page_host(url), english_words, page_hash,
+        len(_current_page.outlinks))
     save_all()
     return links
 
@@ -330,6 +467,8 @@ def is_valid(url):
         ):
             return False
         # print(parsed)
+        if not robots.is_allowed(url):
+            return False
         return not re.match(
             r".*\.(css|js|bmp|gif|jpe?g|ico|sql|conf"
             + r"|png|tiff?|mid|mp2|mp3|mp4|bam"
@@ -347,7 +486,7 @@ def is_valid(url):
         )
 
     except TypeError:
-        print("TypeError for ", parsed)
+        logger.error(f"TypeError for {parsed}")
         raise
 
 
@@ -1,35 +1,165 @@
 import os
+import atexit
+import json
 import logging
+import time
 from hashlib import sha256
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue
+from threading import Lock
 from urllib.parse import urlparse
 
-def get_logger(name, filename=None):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+from utils.canonical import canonicalize
+
+LOG_DIR = "Logs"
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+# Console lines allowed per logger per second before sampling kicks in.
+CONSOLE_RATE = 20
+# Page events allowed per event type per second before sampling kicks in.
+PAGE_EVENT_RATE = 50
+# Once over the rate, one in this many records is kept.
+SAMPLE_EVERY = 10
+
+_log_queue = Queue(-1)
+_listener = None
+_router = None
+_setup_lock = Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per key, sampling records once the bucket is empty.
+
+    Kept records get a `weight` attribute (1, or SAMPLE_EVERY when sampled)
+    so counts can still be estimated from a sampled log. Warnings and
+    errors are never dropped."""
+    def __init__(self, rate, key=lambda record: record.name):
+        super().__init__()
+        self.rate = rate
+        self.key = key
+        self.buckets = dict()
+
+    def filter(self, record):
+        record.weight = 1
+        if record.levelno >= logging.WARNING:
+            return True
+        key = self.key(record)
+        now = time.monotonic()
+        tokens, last, skipped = self.buckets.get(key, (self.rate, now, 0))
+        tokens = min(self.rate, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now, skipped)
+            return True
+        skipped += 1
+        self.buckets[key] = (tokens, now, skipped % SAMPLE_EVERY)
+        if skipped % SAMPLE_EVERY:
+            return False
+        record.weight = SAMPLE_EVERY
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {"time": round(record.created, 3), "event": record.getMessage()}
+        event.update(getattr(record, "fields", {}))
+        if record.weight != 1:
+            event["weight"] = record.weight
+        return json.dumps(event)
+
+
+class _RoutingHandler(logging.Handler):
+    """Runs on the listener thread, writes each record to its own log file
+    and, unless it is a page event, to the console."""
+    def __init__(self):
+        super().__init__()
+        self.files = dict()
+        self.console = logging.StreamHandler()
+        self.console.setLevel(logging.INFO)
+        self.console.addFilter(RateLimitFilter(CONSOLE_RATE))
+        self.formatter = logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.console.setFormatter(self.formatter)
+
+    def add_file(self, filename, formatter=None):
+        if filename not in self.files:
+            fh = RotatingFileHandler(
+                f"{LOG_DIR}/{filename}", maxBytes=MAX_LOG_BYTES,
+                backupCount=LOG_BACKUPS)
+            fh.setLevel(logging.DEBUG)
+            fh.setFormatter(formatter or self.formatter)
+            self.files[filename] = fh
+
+    def emit(self, record):
+        self.files[record.log_file].handle(record)
+        if not getattr(record, "fields", None):
+            self.console.handle(record)
+
+    def close(self):
+        for fh in self.files.values():
+            fh.close()
+        super().close()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+        _router.close()
+
+
+def _attach(logger, filename, formatter=None):
+    """Route `logger` through the background listener into Logs/filename.
+
+    Safe to call repeatedly, a logger only ever gets one queue handler."""
+    global _listener, _router
+    with _setup_lock:
+        if any(getattr(h, "_crawler_queue", False) for h in logger.handlers):
+            return logger
+        if _listener is None:
+            if not os.path.exists(LOG_DIR):
+                os.makedirs(LOG_DIR)
+            _router = _RoutingHandler()
+            _listener = QueueListener(_log_queue, _router)
+            _listener.start()
+            atexit.register(_stop_listener)
+        _router.add_file(filename, formatter)
+        qh = QueueHandler(_log_queue)
+        qh._crawler_queue = True
+
+        def tag(record):
+            record.log_file = filename
+            return True
+        qh.addFilter(tag)
+        logger.addHandler(qh)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
     return logger
 
 
+def get_logger(name, filename=None):
+    return _attach(
+        logging.getLogger(name), f"{filename if filename else name}.log")
+
+
+_page_logger = None
+
+
+def log_page_event(event, url, **fields):
+    """Write one structured per-page event as a JSON line to Logs/pages.jsonl.
+
+    High volume event types are sampled, see RateLimitFilter."""
+    global _page_logger
+    if _page_logger is None:
+        logger = logging.getLogger("PAGES")
+        logger.addFilter(RateLimitFilter(
+            PAGE_EVENT_RATE, key=lambda record: record.msg))
+        _page_logger = _attach(logger, "pages.jsonl", JsonFormatter())
+    fields["url"] = url
+    _page_logger.info(event, extra={"fields": fields})
+
+
 def get_urlhash(url):
-    parsed = urlparse(url)
+    parsed = urlparse(canonicalize(url))
     # everything other than scheme.
     return sha256(
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
-
-def normalize(url):
-    if url.endswith("/"):
-        return url.rstrip("/")
-    return url
@@ -0,0 +1,118 @@
+import time
+
+from hashlib import blake2b
+from threading import RLock
+from urllib.parse import urlparse
+
+# Consecutive failures after which an endpoint is taken out of rotation.
+EJECT_FAILURES = 3
+# First ejection period in seconds, doubled on every repeated ejection.
+EJECT_SECONDS = 30.0
+MAX_EJECT_SECONDS = 300.0
+# Weight of the newest sample in an endpoint's latency average.
+LATENCY_ALPHA = 0.2
+
+
+def parse_endpoints(value):
+    ''' Endpoints from "host:port,host:port" or a Register load_balancer,
+    which is either one (host, port) pair or a sequence of them. '''
+    if isinstance(value, str):
+        endpoints = list()
+        for item in value.split(","):
+            if item.strip():
+                host, port = item.strip().rsplit(":", 1)
+                endpoints.append((host, int(port)))
+        return endpoints
+    if len(value) == 2 and isinstance(value[0], str):
+        return [(value[0], int(value[1]))]
+    return [(host, int(port)) for host, port in value]
+
+
+class CacheEndpoint(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+
+class CachePool(object):
+    ''' Client side balancing of downloads over several cache servers.
+
+    routing="host" (the default) sends every url of a host to the same
+    endpoint by rendezvous hashing, so a host's requests stay on one cache
+    server and only move when that server is ejected. routing="least" picks
+    the endpoint with the fewest requests in flight, then the lowest
+    average latency.
+
+    Health is checked passively: an endpoint that fails EJECT_FAILURES
+    requests in a row is ejected for a period that doubles on every repeat
+    ejection. Once the period is over it is re-admitted on probation: one
+    failure ejects it again, one success makes it healthy. If every
+    endpoint is ejected the one due back first is used.'''
+    def __init__(self, endpoints, routing="host", logger=None):
+        assert endpoints, "Need at least one cache server"
+        assert routing in ("host", "least"), f"Unknown cache routing {routing}"
+        self.endpoints = [CacheEndpoint(host, port) for host, port in endpoints]
+        self.routing = routing
+        self.logger = logger
+        self.lock = RLock()
+
+    def _score(self, endpoint, host):
+        key = f"{host}|{endpoint.host}:{endpoint.port}".encode("utf-8")
+        return blake2b(key, digest_size=8).digest()
+
+    def choose(self, url):
+        ''' Pick an endpoint for url and count the request as in flight. '''
+        now = time.time()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.available(now)]
+            if not candidates:
+                candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+            if self.routing == "host":
+                host = urlparse(url).netloc.lower()
+                endpoint = max(candidates, key=lambda e: self._score(e, host))
+            else:
+                endpoint = min(candidates, key=lambda e: (
+                    e.outstanding, e.latency if e.latency is not None else 0.0))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def finish(self, endpoint, latency, ok):
+        with self.lock:
+            endpoint.outstanding -= 1
+            if not ok:
+                endpoint.failures += 1
+                # A re-admitted endpoint is on probation, one failure is enough.
+                limit = 1 if endpoint.ejections else EJECT_FAILURES
+                if endpoint.failures >= limit and (
+                        endpoint.available(time.time())):
+                    period = min(
+                        MAX_EJECT_SECONDS, EJECT_SECONDS * 2 ** endpoint.ejections)
+                    if self.logger:
+                        self.logger.warning(
+                            f"Ejecting cache server {endpoint} for {period:.0f}s "
+                            f"after {endpoint.failures} failures.")
+                    endpoint.ejections += 1
+                    endpoint.ejected_until = time.time() + period
+                    endpoint.failures = 0
+                return
+            if endpoint.ejections and self.logger:
+                self.logger.info(f"Cache server {endpoint} is healthy again.")
+            endpoint.failures = 0
+            endpoint.ejections = 0
+            endpoint.latency = latency if endpoint.latency is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * endpoint.latency)
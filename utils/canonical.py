@@ -0,0 +1,131 @@
+import re
+
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, quote
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Last path segments that name the directory's default document.
+INDEX_FILES = frozenset([
+    "index.html", "index.htm", "index.shtml", "index.php", "index.asp",
+    "index.aspx", "index.jsp", "default.htm", "default.html", "default.asp",
+    "default.aspx"])
+
+# Query parameters that only track the visitor or carry a session, any
+# parameter starting with utm_ is dropped as well.
+DEFAULT_STRIP_PARAMS = frozenset([
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl",
+    "sid", "sessionid", "session_id", "phpsessid", "jsessionid",
+    "aspsessionid", "cfid", "cftoken"])
+
+strip_params = DEFAULT_STRIP_PARAMS
+
+# Already canonical: lowercase scheme and host, no port, userinfo, query or
+# fragment, and a path of plain segments without dots, escapes or a
+# trailing slash.
+_CANONICAL = re.compile(
+    r"^https?://[a-z0-9-]+(?:\.[a-z0-9-]+)*(?:/[A-Za-z0-9_~-]+)*$")
+_ESCAPE = re.compile(r"%([0-9A-Fa-f]{2})")
+_BAD_PERCENT = re.compile(r"%(?![0-9A-Fa-f]{2})")
+_UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+# Characters left as they are in paths. '%' is kept because escapes have
+# been normalised already.
+_PATH_SAFE = "/:@!$&'()*+,;=-._~%"
+# Query keys and values are fully decoded by parse_qsl, so '%' and '+' (a
+# space in queries) must be escaped again or a second pass changes them.
+_QUERY_SAFE = ":@!$'()*,;/?-._~"
+
+
+def configure(params=None):
+    ''' Replace the set of query parameters stripped from urls. '''
+    global strip_params
+    strip_params = (
+        DEFAULT_STRIP_PARAMS if params is None
+        else frozenset(param.lower() for param in params))
+    _canonicalize.cache_clear()
+
+
+def _normalize_escapes(component, safe):
+    ''' Decode escaped unreserved characters, uppercase the other escapes
+    and escape whatever is not allowed in the component. '''
+    def unescape(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in _UNRESERVED else "%" + match.group(1).upper()
+    component = _ESCAPE.sub(unescape, component)
+    component = _BAD_PERCENT.sub("%25", component)
+    return quote(component, safe=safe)
+
+
+def remove_dot_segments(path):
+    ''' RFC 3986 section 5.2.4, also collapses empty segments. '''
+    output = list()
+    for segment in path.split("/"):
+        if segment == "..":
+            if output:
+                output.pop()
+        elif segment and segment != ".":
+            output.append(segment)
+    trailing = path.endswith(("/", "/.", "/.."))
+    return "/" + "/".join(output) + ("/" if trailing and output else "")
+
+
+def _canonical_query(query):
+    params = [
+        (key, value) for key, value in parse_qsl(query, keep_blank_values=True)
+        if key and key.lower() not in strip_params
+        and not key.lower().startswith("utm_")]
+    params.sort()
+    return "&".join(
+        f"{quote(key, safe=_QUERY_SAFE)}={quote(value, safe=_QUERY_SAFE)}"
+        if value else quote(key, safe=_QUERY_SAFE)
+        for key, value in params)
+
+
+@lru_cache(maxsize=65536)
+def _canonicalize(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    host = parts.hostname
+    if host is None:
+        return url
+    host = host.rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    # Port 443 means TLS whatever the scheme says.
+    if scheme == "http" and port == 443:
+        scheme = "https"
+    netloc = host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    if parts.username is not None:
+        netloc = f"{parts.username}@{netloc}"
+
+    # Session ids passed as path parameters, e.g. /a;jsessionid=123
+    path = re.sub(r";(jsessionid|phpsessid|sid)=[^/]*", "", parts.path,
+                  flags=re.IGNORECASE)
+    path = remove_dot_segments(_normalize_escapes(path, _PATH_SAFE)).rstrip("/")
+    directory, _, last = path.rpartition("/")
+    while last.lower() in INDEX_FILES:
+        path = directory
+        directory, _, last = path.rpartition("/")
+    query = _canonical_query(parts.query)
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def canonicalize(url):
+    ''' Canonical form of url, so that equivalent urls compare equal.
+
+    Lowercases scheme and host, drops default ports, userinfo passwords and
+    the fragment, resolves dot segments, normalises percent-encoding,
+    strips index files and the trailing slash, and sorts the query after
+    removing tracking and session parameters. Idempotent: canonicalizing a
+    canonical url returns it unchanged.'''
+    url = url.strip()
+    if _CANONICAL.match(url):
+        return url
+    return _canonicalize(url)
@@ -8,12 +8,31 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.min_threads = int(config["LOCAL PROPERTIES"].get(
+            "MINTHREADS", self.threads_count))
+        self.max_threads = int(config["LOCAL PROPERTIES"].get(
+            "MAXTHREADS", self.threads_count))
+        assert 1 <= self.min_threads <= self.max_threads, "Need 1 <= MINTHREADS <= MAXTHREADS"
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.page_store_file = config["LOCAL PROPERTIES"].get(
+            "PAGESTORE", "pages.shelve")
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        # Query parameters removed from every url, None keeps the defaults.
+        self.strip_params = None
+        if config["CRAWLER"].get("STRIPPARAMS"):
+            self.strip_params = [
+                param.strip()
+                for param in config["CRAWLER"]["STRIPPARAMS"].split(",")]
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Extra cache servers to balance over instead of registering.
+        self.cache_servers = config["CONNECTION"].get("CACHESERVERS", "").strip()
+        self.cache_routing = config["CONNECTION"].get("CACHEROUTING", "host").strip()
+        self.cache_pool = None
+        self.incremental = False
+        self.profiler = None
\ No newline at end of file
@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+
+from utils.link_graph import GRAPH_DIR
+
+EDGE_DTYPE = np.uint32
+
+
+class CSRGraph(object):
+    ''' Deduplicated link graph in compressed sparse row form.
+
+    The out-links of url id i are indices[indptr[i]:indptr[i + 1]]. Both
+    arrays are .npy files opened memory-mapped.'''
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.indices, minlength=self.nodes)
+
+    def sources(self):
+        ''' Source id of every edge, aligned with indices. '''
+        return np.repeat(
+            np.arange(self.nodes, dtype=EDGE_DTYPE), self.out_degree())
+
+    def host_links(self, host_of):
+        ''' (outgoing, incoming, internal) edge counts per host id.
+
+        host_of maps url id to host id. Internal edges stay within a host
+        and are counted in neither outgoing nor incoming.'''
+        host_count = int(host_of.max()) + 1 if len(host_of) else 0
+        src_host = host_of[self.sources()]
+        dst_host = host_of[self.indices]
+        internal = src_host == dst_host
+        return (
+            np.bincount(src_host[~internal], minlength=host_count),
+            np.bincount(dst_host[~internal], minlength=host_count),
+            np.bincount(src_host[internal], minlength=host_count))
+
+    def pagerank(self, damping=0.85, tolerance=1e-8, max_iterations=100):
+        ''' PageRank by power iteration, dangling mass spread uniformly. '''
+        n = self.nodes
+        if n == 0:
+            return np.zeros(0)
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        safe_degree = np.where(dangling, 1, out_degree)
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iterations):
+            share = np.repeat(rank / safe_degree, out_degree)
+            spread = damping * rank[dangling].sum() / n
+            new_rank = (
+                damping * np.bincount(self.indices, weights=share, minlength=n)
+                + (1 - damping) / n + spread)
+            done = np.abs(new_rank - rank).sum() < tolerance
+            rank = new_rank
+            if done:
+                break
+        return rank
+
+
+def compact(directory=GRAPH_DIR, nodes=0):
+    ''' Turn edges.bin into indptr.npy/indices.npy, skipped if up to date. '''
+    edges_file = os.path.join(directory, "edges.bin")
+    meta_file = os.path.join(directory, "csr.json")
+    size = os.path.getsize(edges_file) if os.path.exists(edges_file) else 0
+    try:
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if meta["log_bytes"] == size and meta["nodes"] >= nodes:
+            return load(directory)
+    except (FileNotFoundError, ValueError):
+        pass
+    pairs = np.fromfile(edges_file, dtype=EDGE_DTYPE) if size else (
+        np.zeros(0, dtype=EDGE_DTYPE))
+    src = pairs[0::2].astype(np.uint64)
+    dst = pairs[1::2].astype(np.uint64)
+    nodes = max(nodes, int(max(src.max(), dst.max())) + 1 if len(src) else 0)
+    # Sorting the combined key both orders by source and drops duplicates.
+    keys = np.unique(src * np.uint64(nodes) + dst)
+    src = keys // np.uint64(nodes)
+    indices = (keys % np.uint64(nodes)).astype(EDGE_DTYPE)
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src.astype(np.int64), minlength=nodes),
+              out=indptr[1:])
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    np.save(os.path.join(directory, "indptr.npy"), indptr)
+    np.save(os.path.join(directory, "indices.npy"), indices)
+    with open(meta_file, "w") as f:
+        json.dump({"log_bytes": size, "nodes": nodes, "edges": len(indices)}, f)
+    return load(directory)
+
+
+def load(directory=GRAPH_DIR):
+    return CSRGraph(
+        np.load(os.path.join(directory, "indptr.npy"), mmap_mode="r"),
+        np.load(os.path.join(directory, "indices.npy"), mmap_mode="r"))
@@ -2,20 +2,43 @@ import requests
 import cbor
 import time
 
+from utils.cache_pool import CachePool, parse_endpoints
 from utils.response import Response
 
+# Seconds to wait for the cache server before giving up on a request.
+TIMEOUT = 60
+
+def get_pool(config):
+    # Set up by launch.py; a lone cache_server gets a pool of one.
+    if config.cache_pool is None:
+        config.cache_pool = CachePool(parse_endpoints(config.cache_server))
+    return config.cache_pool
+
 def download(url, config, logger=None):
-    host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    pool = get_pool(config)
+    endpoint = pool.choose(url)
+    start = time.monotonic()
+    try:
+        resp = requests.get(
+            f"http://{endpoint.host}:{endpoint.port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+            timeout=TIMEOUT)
+    except requests.RequestException:
+        pool.finish(endpoint, time.monotonic() - start, ok=False)
+        raise
     try:
         if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+            response = Response(cbor.loads(resp.content))
+            pool.finish(endpoint, time.monotonic() - start, ok=True)
+            response.cache_server = endpoint.address
+            return response
     except (EOFError, ValueError) as e:
         pass
+    pool.finish(endpoint, time.monotonic() - start, ok=False)
     logger.error(f"Spacetime Response error {resp} with url {url}.")
-    return Response({
+    response = Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
         "url": url})
+    response.cache_server = endpoint.address
+    return response
@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+
+from array import array
+from collections import Counter
+from threading import RLock
+
+from utils.ids import IdMap
+
+FEATURES_DIR = "cache/features"
+URL_IDS_FILE = "cache/url_ids.txt"
+# Pages per segment before it is written out.
+SEGMENT_ROWS = 8192
+
+# Row flags.
+ACCEPTED = 0
+# Counted as a crawled page, but its content was rejected by the scraper.
+SKIPPED = 1
+# Tombstone, an earlier row for the same url no longer counts.
+RETRACTED = 2
+
+# Column name -> array typecode. Per page columns first, word_ids and
+# word_counts hold every page's words back to back, word_ends[i] is where
+# page i's words end.
+COLUMNS = {
+    "url_id": "I", "host_id": "I", "flags": "B", "word_count": "I",
+    "fingerprint": "Q", "outlinks": "I", "word_ends": "Q",
+    "word_ids": "I", "word_counts": "I"}
+
+
+def numpy_dtype(typecode):
+    kind = "i" if typecode in "bhilq" else "u"
+    order = "<" if sys.byteorder == "little" else ">"
+    return f"{order}{kind}{array(typecode).itemsize}"
+
+
+class FeatureWriter(object):
+    ''' Append-only columnar store of per page features.
+
+    Rows are buffered in typed arrays and written as a segment directory of
+    raw column files (readable with numpy.fromfile, see report.py) once
+    SEGMENT_ROWS pages are buffered or flush() is called. Segments are
+    never rewritten; a url that is scraped again gets a new row and readers
+    keep the latest one.'''
+    def __init__(self, directory=FEATURES_DIR, url_ids=None):
+        self.directory = directory
+        self.lock = RLock()
+        self.url_ids = url_ids if url_ids is not None else IdMap(URL_IDS_FILE)
+        self.host_ids = IdMap(os.path.join(directory, "hosts.txt"))
+        self.word_ids = IdMap(os.path.join(directory, "words.txt"))
+        self.next_segment = 0
+        if os.path.exists(directory):
+            self.next_segment = len([
+                name for name in os.listdir(directory)
+                if name.startswith("seg-")])
+        self._reset()
+
+    def _reset(self):
+        self.columns = {
+            name: array(typecode) for name, typecode in COLUMNS.items()}
+
+    def append(self, url, host, words=(), fingerprint=0, outlinks=0,
+               flags=ACCEPTED):
+        counts = Counter(words)
+        word_ids = [self.word_ids.id_for(word) for word in counts]
+        with self.lock:
+            columns = self.columns
+            columns["url_id"].append(self.url_ids.id_for(url))
+            columns["host_id"].append(self.host_ids.id_for(host))
+            columns["flags"].append(flags)
+            columns["word_count"].append(len(words))
+            columns["fingerprint"].append(fingerprint or 0)
+            columns["outlinks"].append(outlinks)
+            columns["word_ids"].extend(word_ids)
+            columns["word_counts"].extend(counts.values())
+            columns["word_ends"].append(len(columns["word_ids"]))
+            if len(columns["url_id"]) >= SEGMENT_ROWS:
+                self.flush()
+
+    def retract(self, url, host):
+        self.append(url, host, flags=RETRACTED)
+
+    def flush(self):
+        with self.lock:
+            rows = len(self.columns["url_id"])
+            if not rows:
+                return
+            # Ids referenced by the segment must be on disk first.
+            self.url_ids.flush()
+            self.host_ids.flush()
+            self.word_ids.flush()
+            name = f"seg-{self.next_segment:06d}"
+            tmp_path = os.path.join(self.directory, f"tmp-{name}")
+            os.makedirs(tmp_path, exist_ok=True)
+            for column, values in self.columns.items():
+                with open(os.path.join(tmp_path, column), "wb") as f:
+                    values.tofile(f)
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({
+                    "rows": rows,
+                    "columns": {
+                        column: numpy_dtype(typecode)
+                        for column, typecode in COLUMNS.items()}}, f)
+            # Readers only look at seg-* directories, so a segment appears
+            # complete or not at all.
+            os.rename(tmp_path, os.path.join(self.directory, name))
+            self.next_segment += 1
+            self._reset()
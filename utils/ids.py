@@ -0,0 +1,55 @@
+import json
+import os
+
+from threading import RLock
+
+
+def load_strings(path):
+    ''' List of strings of an IdMap file, indexed by id. '''
+    try:
+        with open(path, "r") as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+
+class IdMap(object):
+    ''' Append-only mapping of strings to dense integer ids.
+
+    Persisted as one JSON string per line, so line n holds the string with
+    id n. New ids are buffered and written on flush().'''
+    def __init__(self, path):
+        self.path = path
+        self.lock = RLock()
+        self.ids = {key: i for i, key in enumerate(load_strings(path))}
+        self.pending = list()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def id_for(self, key):
+        key_id = self.ids.get(key)
+        if key_id is not None:
+            return key_id
+        with self.lock:
+            key_id = self.ids.get(key)
+            if key_id is None:
+                key_id = len(self.ids)
+                self.ids[key] = key_id
+                self.pending.append(key)
+        return key_id
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, "a") as f:
+                for key in self.pending:
+                    f.write(json.dumps(key) + "\n")
+            self.pending = list()
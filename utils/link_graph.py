@@ -0,0 +1,93 @@
+import json
+import os
+
+from array import array
+from threading import RLock
+
+GRAPH_DIR = "cache/graph"
+# Edges buffered in memory before they are appended to the log.
+FLUSH_EDGES = 65536
+
+
+class EdgeLog(object):
+    ''' Append-only log of (source url id, destination url id) pairs.
+
+    edges.bin is a flat sequence of uint32 pairs, compacted offline into CSR
+    arrays by utils.csr_graph. A live in-degree per url id is kept alongside
+    so the frontier can prioritise well linked pages while crawling; it is
+    checkpointed on every flush so startup only replays the log's tail.
+
+    The scraper logs each link once per page, but a page that is scraped
+    again (--incremental) logs its links again. The CSR arrays drop those
+    duplicates, the live in-degree counts them, so it can run ahead of the
+    in-degree report.py prints for re-crawled pages.'''
+    def __init__(self, url_ids, directory=GRAPH_DIR):
+        self.url_ids = url_ids
+        self.directory = directory
+        self.edges_file = os.path.join(directory, "edges.bin")
+        self.in_degree_file = os.path.join(directory, "in_degree.bin")
+        self.meta_file = os.path.join(directory, "in_degree.json")
+        self.lock = RLock()
+        self.pending = array("I")
+        self.in_degree = array("I")
+        self.logged_edges = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.edges_file):
+            return
+        covered = 0
+        try:
+            with open(self.meta_file, "r") as f:
+                covered = json.load(f)["edges"]
+            with open(self.in_degree_file, "rb") as f:
+                self.in_degree.frombytes(f.read())
+        except (FileNotFoundError, ValueError):
+            covered = 0
+            self.in_degree = array("I")
+        itemsize = self.pending.itemsize
+        self.logged_edges = os.path.getsize(self.edges_file) // (2 * itemsize)
+        # Replay edges written after the last checkpoint.
+        with open(self.edges_file, "rb") as f:
+            f.seek(covered * 2 * itemsize)
+            tail = array("I")
+            tail.frombytes(f.read((self.logged_edges - covered) * 2 * itemsize))
+        for dst in tail[1::2]:
+            self._count(dst)
+
+    def _count(self, dst):
+        if dst >= len(self.in_degree):
+            self.in_degree.extend([0] * (dst + 1 - len(self.in_degree)))
+        self.in_degree[dst] += 1
+
+    def add_edge(self, src_url, dst_url):
+        src = self.url_ids.id_for(src_url)
+        dst = self.url_ids.id_for(dst_url)
+        with self.lock:
+            self.pending.append(src)
+            self.pending.append(dst)
+            self._count(dst)
+            if len(self.pending) >= 2 * FLUSH_EDGES:
+                self.flush()
+
+    def in_degree_of(self, url):
+        url_id = self.url_ids.get(url)
+        if url_id is None or url_id >= len(self.in_degree):
+            return 0
+        return self.in_degree[url_id]
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.url_ids.flush()
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            with open(self.edges_file, "ab") as f:
+                self.pending.tofile(f)
+            self.logged_edges += len(self.pending) // 2
+            self.pending = array("I")
+            with open(self.in_degree_file, "wb") as f:
+                self.in_degree.tofile(f)
+            with open(self.meta_file, "w") as f:
+                json.dump({"edges": self.logged_edges}, f)
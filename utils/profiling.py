@@ -0,0 +1,206 @@
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from collections import Counter
+from threading import Thread, RLock, Event, get_ident
+
+from utils import get_logger
+
+PROFILE_DIR = "Logs/profile"
+# Seconds between two stack samples.
+SAMPLE_INTERVAL = 0.01
+
+# Stage a sample is charged to: the innermost frame on the stack that
+# matches one of these (function name, file name suffix) pairs.
+STAGES = (
+    ("network", "download", "download.py"),
+    ("waiting", "wait_turn", "concurrency.py"),
+    ("waiting", "wait_for_work", "concurrency.py"),
+    ("scraper_lock", "scraper_lock", "worker.py"),
+    ("politeness", "wait_politeness", "frontier.py"),
+    ("frontier", "add_url", "frontier.py"),
+    ("frontier", "get_tbd_url", "frontier.py"),
+    ("parse", "__init__", "bs4/__init__.py"),
+    ("parse", "get_text", "element.py"),
+    ("filter_words", "filter_words", "scraper.py"),
+    ("similarity", "compute_similarity_hash", "scraper.py"),
+    ("similarity", "are_pages_similar", "scraper.py"),
+    ("save_all", "save_all", "scraper.py"),
+    ("shelve_sync", "sync", "shelve.py"),
+)
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def stage_of(frames):
+    ''' Stage of a stack given root first as code objects. '''
+    stage = "other"
+    for code in frames:
+        for name, function, filename in STAGES:
+            if code.co_name == function and code.co_filename.endswith(filename):
+                stage = name
+    return stage
+
+
+def write_collapsed(path, stacks):
+    ''' Collapsed stack format read by flamegraph.pl and speedscope. '''
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class Profiler(object):
+    ''' Profiles the workers for a bounded window of pages or seconds.
+
+    A sampler thread records every worker's stack each SAMPLE_INTERVAL and
+    writes collapsed stacks and a per-stage breakdown per worker and merged,
+    to a new timestamped subdirectory of `directory` for every run.
+    With cprofile=True each worker thread also runs cProfile for the window
+    and dumps worker-<id>.prof, merged into merged.prof. With memory=True a
+    tracemalloc snapshot is written at the end of the window. Nothing is
+    recorded once the window closes.'''
+    def __init__(self, pages=200, seconds=120.0, cprofile=False,
+                 memory=False, directory=PROFILE_DIR):
+        self.logger = get_logger("PROFILER", "CRAWLER")
+        self.pages = pages
+        self.seconds = seconds
+        self.cprofile = cprofile
+        self.memory = memory
+        self.directory = directory
+        self.lock = RLock()
+        self.done = Event()
+        self.page_count = 0
+        self.started = None
+        self.threads = dict()
+        self.profiles = dict()
+        self.stacks = dict()
+        self.stages = dict()
+        self.sampler = Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        # One subdirectory per run, so merging never picks up old files.
+        self.directory = os.path.join(
+            self.directory, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            tracemalloc.start(25)
+        self.started = time.time()
+        self.sampler.start()
+        self.logger.info(
+            f"Profiling for {self.pages} pages or {self.seconds}s, "
+            f"writing to {self.directory}.")
+
+    def register(self, worker_id):
+        ''' Called from the worker's own thread before it starts crawling. '''
+        if self.done.is_set():
+            return
+        with self.lock:
+            self.threads[get_ident()] = worker_id
+            self.stacks[worker_id] = Counter()
+            self.stages[worker_id] = Counter()
+        if self.cprofile:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Newer Pythons allow only one active profiler at a time.
+                self.logger.warning(
+                    f"cProfile already active, worker {worker_id} is only sampled.")
+                return
+            self.profiles[worker_id] = profile
+
+    def page_done(self, worker_id):
+        ''' Called from the worker's thread after every page. '''
+        if worker_id not in self.profiles and self.done.is_set():
+            return
+        with self.lock:
+            self.page_count += 1
+            expired = (
+                self.page_count >= self.pages
+                or time.time() - self.started >= self.seconds)
+        if expired or self.done.is_set():
+            self.unregister(worker_id)
+
+    def unregister(self, worker_id):
+        ''' Stop profiling the calling worker, ends the window for all. '''
+        self._finish()
+        profile = self.profiles.pop(worker_id, None)
+        if profile is None:
+            return
+        # cProfile hooks are per thread, so this has to run on the worker.
+        profile.disable()
+        profile.dump_stats(os.path.join(self.directory, f"worker-{worker_id}.prof"))
+        self._merge_profiles()
+
+    def _merge_profiles(self):
+        with self.lock:
+            paths = [
+                os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if name.startswith("worker-") and name.endswith(".prof")]
+            if not paths:
+                return
+            stats = pstats.Stats(*paths)
+            stats.dump_stats(os.path.join(self.directory, "merged.prof"))
+            with open(os.path.join(self.directory, "merged.txt"), "w") as f:
+                pstats.Stats(*paths, stream=f).sort_stats(
+                    "cumulative").print_stats(50)
+
+    def _sample(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, worker_id in self.threads.items():
+                    frame = frames.get(ident)
+                    codes = list()
+                    while frame is not None:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    if not codes:
+                        continue
+                    codes.reverse()
+                    self.stacks[worker_id][
+                        ";".join(frame_label(code) for code in codes)] += 1
+                    self.stages[worker_id][stage_of(codes)] += 1
+            if time.time() - self.started >= self.seconds:
+                self._finish()
+
+    def _finish(self):
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.done.set()
+            merged_stacks = Counter()
+            merged_stages = Counter()
+            for worker_id, stacks in self.stacks.items():
+                write_collapsed(os.path.join(
+                    self.directory, f"worker-{worker_id}.collapsed"), stacks)
+                merged_stacks.update(stacks)
+                merged_stages.update(self.stages[worker_id])
+            write_collapsed(
+                os.path.join(self.directory, "merged.collapsed"), merged_stacks)
+            with open(os.path.join(self.directory, "stages.txt"), "w") as f:
+                sections = [
+                    (f"worker-{worker_id}", stages)
+                    for worker_id, stages in sorted(self.stages.items())]
+                for name, stages in sections + [("merged", merged_stages)]:
+                    total = sum(stages.values()) or 1
+                    f.write(f"{name}:\n")
+                    for stage, count in stages.most_common():
+                        f.write(f"  {stage}: {count} samples, {count / total:.1%}\n")
+            if self.memory and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                snapshot.dump(os.path.join(self.directory, "tracemalloc.snapshot"))
+                with open(os.path.join(self.directory, "tracemalloc.txt"), "w") as f:
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        f.write(f"{stat}\n")
+        self.logger.info(
+            f"Profiling window closed after {self.page_count} pages, "
+            f"{time.time() - self.started:.0f}s.")
@@ -5,6 +5,8 @@ class Response(object):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
+        # (host, port) of the cache server that answered, set by download.
+        self.cache_server = None
         try:
             self.raw_response = (
                 pickle.loads(resp_dict["response"])
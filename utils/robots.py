@@ -0,0 +1,308 @@
+import json
+import os
+import re
+import time
+from threading import RLock, Event
+from urllib.parse import urlparse
+
+from requests import RequestException
+from utils.download import download
+
+ROBOTS_FILE = "cache/robots_rules.txt"
+# How long fetched rules stay valid before robots.txt is fetched again.
+ROBOTS_TTL = 24 * 60 * 60
+# Retry sooner when the robots.txt fetch itself failed.
+ROBOTS_ERROR_TTL = 60 * 60
+# Upper bound on a Crawl-delay we are willing to honour, in seconds.
+MAX_CRAWL_DELAY = 30.0
+MAX_SITEMAPS_PER_HOST = 20
+
+_active = None
+
+
+def set_active(cache):
+    """Make `cache` the one consulted by is_allowed (and so by is_valid)."""
+    global _active
+    _active = cache
+
+
+def is_allowed(url):
+    """Cheap check used by scraper.is_valid.
+
+    Only consults rules that are already cached, it never fetches. Hosts
+    that have not been seen yet are allowed here and checked properly when
+    the url reaches Frontier.add_url."""
+    if _active is None:
+        return True
+    return _active.allowed_if_known(url)
+
+
+def _compile_pattern(pattern):
+    # Plain prefixes are the common case, keep them as strings.
+    if "*" not in pattern and not pattern.endswith("$"):
+        return pattern
+    anchored = pattern.endswith("$")
+    if anchored:
+        pattern = pattern[:-1]
+    regex = ".*".join(re.escape(part) for part in pattern.split("*"))
+    return re.compile(regex + ("$" if anchored else ""))
+
+
+class RobotsRules(object):
+    def __init__(self, allow=(), disallow=(), crawl_delay=None, sitemaps=()):
+        self.allow = list(allow)
+        self.disallow = list(disallow)
+        self.crawl_delay = crawl_delay
+        self.sitemaps = list(sitemaps)
+        # Longest pattern wins, allow wins ties. Sorting once here means a
+        # check is a scan that stops at the first match.
+        rules = [(len(p), True, p) for p in self.allow if p]
+        rules += [(len(p), False, p) for p in self.disallow if p]
+        rules.sort(key=lambda rule: (-rule[0], not rule[1]))
+        self._rules = [
+            (allowed, _compile_pattern(pattern)) for _, allowed, pattern in rules]
+        self._allow_all = not any(not allowed for allowed, _ in self._rules)
+
+    def can_fetch(self, url):
+        if self._allow_all:
+            return True
+        parsed = urlparse(url)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        for allowed, matcher in self._rules:
+            if isinstance(matcher, str):
+                if path.startswith(matcher):
+                    return allowed
+            elif matcher.match(path):
+                return allowed
+        return True
+
+    def to_dict(self):
+        return {
+            "allow": self.allow, "disallow": self.disallow,
+            "crawl_delay": self.crawl_delay, "sitemaps": self.sitemaps}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["allow"], data["disallow"], data["crawl_delay"],
+            data["sitemaps"])
+
+
+def parse_robots(text, user_agent):
+    """Parse robots.txt content into the rules that apply to `user_agent`.
+
+    The most specific group naming our agent is used, falling back to the
+    `*` group. Sitemap lines apply regardless of group."""
+    agent = user_agent.lower()
+    groups = []
+    sitemaps = []
+    current = None
+    reading_agents = False
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        field, value = line.split(":", 1)
+        field = field.strip().lower()
+        value = value.strip()
+        if field == "user-agent":
+            if not reading_agents:
+                current = {"agents": [], "allow": [], "disallow": [], "delay": None}
+                groups.append(current)
+                reading_agents = True
+            current["agents"].append(value.lower())
+            continue
+        reading_agents = False
+        if field == "sitemap":
+            if value:
+                sitemaps.append(value)
+        elif current is None:
+            continue
+        elif field == "allow":
+            current["allow"].append(value)
+        elif field == "disallow":
+            # An empty Disallow means allow everything.
+            if value:
+                current["disallow"].append(value)
+        elif field == "crawl-delay":
+            try:
+                current["delay"] = float(value)
+            except ValueError:
+                pass
+
+    chosen = None
+    chosen_len = -1
+    for group in groups:
+        for name in group["agents"]:
+            if name == "*" and chosen_len < 0:
+                chosen, chosen_len = group, 0
+            elif name != "*" and name in agent and len(name) > chosen_len:
+                chosen, chosen_len = group, len(name)
+    if chosen is None:
+        return RobotsRules(sitemaps=sitemaps)
+    return RobotsRules(
+        chosen["allow"], chosen["disallow"], chosen["delay"], sitemaps)
+
+
+def parse_sitemap(content):
+    """Return (is_index, locations) for a sitemap or sitemap index."""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="ignore")
+    is_index = "<sitemapindex" in content
+    locations = [
+        loc.strip().replace("&amp;", "&")
+        for loc in re.findall(r"<loc>\s*(.*?)\s*</loc>", content, re.DOTALL)]
+    return is_index, locations
+
+
+class RobotsCache(object):
+    def __init__(self, config, logger, wait=None):
+        self.config = config
+        self.logger = logger
+        # Called with a url before anything is downloaded, so robots.txt
+        # and sitemap fetches go through the same politeness as pages.
+        self.wait = wait
+        self.lock = RLock()
+        self.hosts = dict()
+        # Host -> Event set once its robots.txt fetch in progress is done.
+        # Only callers for the same host wait on it.
+        self.fetching = dict()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(ROBOTS_FILE, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for host, entry in data.items():
+            entry["rules"] = RobotsRules.from_dict(entry["rules"])
+            self.hosts[host] = entry
+        self.logger.info(f"Loaded robots.txt rules for {len(self.hosts)} hosts.")
+
+    def _save(self):
+        data = dict()
+        for host, entry in self.hosts.items():
+            data[host] = dict(entry, rules=entry["rules"].to_dict())
+        if not os.path.exists(os.path.dirname(ROBOTS_FILE)):
+            os.makedirs(os.path.dirname(ROBOTS_FILE))
+        with open(ROBOTS_FILE, "w") as f:
+            json.dump(data, f)
+
+    def _download(self, url):
+        """Download url, or None if the cache server could not be reached."""
+        if self.wait:
+            self.wait(url)
+        try:
+            return download(url, self.config, self.logger)
+        except RequestException as e:
+            self.logger.error(f"Failed to download {url}: {e}")
+            return None
+
+    def _fetch(self, scheme, host):
+        robots_url = f"{scheme}://{host}/robots.txt"
+        resp = self._download(robots_url)
+        status = resp.status if resp is not None else None
+        ttl = ROBOTS_TTL
+        if status == 200 and resp.raw_response is not None:
+            text = resp.raw_response.content.decode("utf-8", errors="ignore")
+            rules = parse_robots(text, self.config.user_agent)
+        else:
+            # 4xx means no robots.txt, so everything is allowed. For server,
+            # cache and transport errors allow too, but try again sooner.
+            rules = RobotsRules()
+            if status is None or status >= 500:
+                ttl = ROBOTS_ERROR_TTL
+        self.logger.info(
+            f"Fetched {robots_url}, status <{status}>, "
+            f"{len(rules.disallow)} disallow rules, "
+            f"crawl delay {rules.crawl_delay}, {len(rules.sitemaps)} sitemaps.")
+        return {
+            "fetched": time.time(), "ttl": ttl, "rules": rules,
+            "sitemaps_done": False}
+
+    def _entry(self, url, fetch=True):
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        entry = self.hosts.get(host)
+        if entry is not None and time.time() - entry["fetched"] < entry["ttl"]:
+            return entry
+        if not fetch:
+            return entry
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is not None and time.time() - entry["fetched"] < entry["ttl"]:
+                return entry
+            done = self.fetching.get(host)
+            if done is None:
+                done = self.fetching[host] = Event()
+                fetching = True
+            else:
+                fetching = False
+        if not fetching:
+            done.wait()
+            return self._entry(url)
+        # The download and its politeness wait happen outside the lock.
+        try:
+            entry = self._fetch(parsed.scheme or "http", host)
+            with self.lock:
+                self.hosts[host] = entry
+                self._save()
+        finally:
+            with self.lock:
+                del self.fetching[host]
+            done.set()
+        return entry
+
+    def is_cached(self, url):
+        return urlparse(url).netloc.lower() in self.hosts
+
+    def can_fetch(self, url):
+        return self._entry(url)["rules"].can_fetch(url)
+
+    def allowed_if_known(self, url):
+        entry = self._entry(url, fetch=False)
+        return entry is None or entry["rules"].can_fetch(url)
+
+    def crawl_delay(self, url):
+        entry = self._entry(url, fetch=False)
+        if entry is None or entry["rules"].crawl_delay is None:
+            return 0.0
+        return min(entry["rules"].crawl_delay, MAX_CRAWL_DELAY)
+
+    def sitemap_urls(self, url):
+        """Page urls listed in the host's sitemaps.
+
+        Each host's sitemaps are only read once per robots.txt fetch, later
+        calls return an empty list. Only urls on the same host are returned."""
+        entry = self._entry(url)
+        with self.lock:
+            if entry["sitemaps_done"]:
+                return []
+            entry["sitemaps_done"] = True
+            self._save()
+        host = urlparse(url).netloc.lower()
+        pending = list(entry["rules"].sitemaps)
+        seen = set()
+        found = []
+        while pending and len(seen) < MAX_SITEMAPS_PER_HOST:
+            sitemap_url = pending.pop(0)
+            if sitemap_url in seen:
+                continue
+            seen.add(sitemap_url)
+            resp = self._download(sitemap_url)
+            if resp is None or resp.status != 200 or resp.raw_response is None:
+                continue
+            is_index, locations = parse_sitemap(resp.raw_response.content)
+            for location in locations:
+                if urlparse(location).netloc.lower() != host:
+                    continue
+                if is_index:
+                    pending.append(location)
+                else:
+                    found.append(location)
+        self.logger.info(
+            f"Read {len(seen)} sitemaps for {host}, found {len(found)} urls.")
+        return found